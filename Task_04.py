@@ -1,7 +1,10 @@
+import os
 import numpy
 import tools
-import numpy.fft as fft
+from scipy import fft
 import matplotlib.pyplot as plt
+from functools import partial
+
 
 class GaussianModPlaneWave:
     ''' Класс с уравнением плоской волны для модулированного гауссова сигнала в дискретном виде
@@ -21,18 +24,188 @@ class GaussianModPlaneWave:
         self.eps = eps
         self.mu = mu
 
+        # Показатель преломления среды в точке расположения источника
+        self._n = numpy.sqrt(self.eps * self.mu)
+
     def getField(self, m, q):
         '''
         Расчет поля E в дискретной точке пространства m
         в дискретный момент времени q
         '''
-        return (numpy.sin(2 * numpy.pi / self.Nl * (q * self.Sc - m * numpy.sqrt(self.eps * self.mu))) *
-                numpy.exp(-(((q - m * numpy.sqrt(self.eps * self.mu) / self.Sc) - self.d) / self.w) ** 2))
+        return (numpy.sin(2 * numpy.pi / self.Nl * (q * self.Sc - m * self._n)) *
+                numpy.exp(-(((q - m * self._n / self.Sc) - self.d) / self.w) ** 2))
 
-if __name__ == '__main__':
-    # Волновое сопротивление свободного пространства
-    W0 = 120.0 * numpy.pi
 
+def stepNumpy(Ez, Hy, ceze, cezh, chyh, chye, src_H, src_E, sourcePos, q,
+              dE, dH):
+    '''
+    Расчет полей E и H за один временной шаг q (на месте, в массивах Ez и Hy)
+    средствами numpy. Используется, если numba недоступна.
+    src_H, src_E - отсчеты источника для полей H и E, уже умноженные
+        на коэффициенты метода Total Field / Scattered Field.
+    sourcePos - положение источника в отсчетах.
+    dE, dH - заранее выделенные буферы размером maxSize - 1 и maxSize - 2,
+        в которых хранятся промежуточные результаты, чтобы не выделять
+        временные массивы на каждом шаге.
+    '''
+    # Расчет компоненты поля Н
+    numpy.subtract(Ez[1:], Ez[:-1], out=dE)
+    numpy.multiply(chye[:-1], dE, out=dE)
+    numpy.multiply(chyh[:-1], Hy, out=Hy)
+    Hy += dE
+
+    # Источник возбуждения с использованием метода
+    # Total Field / Scattered Field
+    Hy[sourcePos - 1] -= src_H[q]
+
+    # Граничные условия для поля E
+    Ez[0] = Ez[1]
+    Ez[-1] = Ez[-2]
+
+    # Расчет компоненты поля E
+    numpy.subtract(Hy[1:], Hy[:-1], out=dH)
+    numpy.multiply(cezh[1:-1], dH, out=dH)
+    numpy.multiply(ceze[1:-1], Ez[1:-1], out=Ez[1:-1])
+    Ez[1:-1] += dH
+
+    # Источник возбуждения с использованием метода
+    # Total Field / Scattered Field
+    Ez[sourcePos] += src_E[q]
+
+
+try:
+    from numba import njit
+except ImportError:
+    # Без numba поля рассчитываются функцией stepNumpy
+    step = None
+else:
+    @njit('void(f4[::1], f4[::1], f4[::1], f4[::1], f4[::1], f4[::1], '
+          'f4[::1], f4[::1], i8, i8)',
+          cache=True, fastmath=True)
+    def step(Ez, Hy, ceze, cezh, chyh, chye, src_H, src_E, sourcePos, q):
+        '''
+        Расчет полей E и H за один временной шаг q (на месте, в массивах Ez и Hy)
+        src_H, src_E - отсчеты источника для полей H и E, уже умноженные
+            на коэффициенты метода Total Field / Scattered Field.
+        sourcePos - положение источника в отсчетах.
+        '''
+        maxSize = Ez.shape[0]
+
+        # Расчет компоненты поля Н
+        for i in range(maxSize - 1):
+            Hy[i] = chyh[i] * Hy[i] + chye[i] * (Ez[i + 1] - Ez[i])
+
+        # Источник возбуждения с использованием метода
+        # Total Field / Scattered Field
+        Hy[sourcePos - 1] -= src_H[q]
+
+        # Граничные условия для поля E
+        Ez[0] = Ez[1]
+        Ez[maxSize - 1] = Ez[maxSize - 2]
+
+        # Расчет компоненты поля E
+        for i in range(1, maxSize - 1):
+            Ez[i] = ceze[i] * Ez[i] + cezh[i] * (Hy[i] - Hy[i - 1])
+
+        # Источник возбуждения с использованием метода
+        # Total Field / Scattered Field
+        Ez[sourcePos] += src_E[q]
+
+
+# Волновое сопротивление свободного пространства
+W0 = 120.0 * numpy.pi
+
+
+def runFDTD(eps, mu, loss, lossBoundaries, source, sourcePos, probesPos,
+            maxTime, Sc=1.0, display=None, display_period=25):
+    '''
+    Расчет распространения волны методом FDTD.
+    eps, mu - относительные диэлектрическая и магнитная проницаемости в ячейках.
+    loss - потери в среде. Loss = sigma * dt / (2 * eps * eps0).
+    lossBoundaries - положения границ поглощающих слоев (в отсчетах),
+        на которых коэффициенты усредняются.
+    source - источник возбуждения для метода Total Field / Scattered Field.
+    sourcePos - положение источника в отсчетах.
+    probesPos - список координат датчиков (в отсчетах).
+    maxTime - время расчета в отсчетах.
+    Sc - число Куранта.
+    display - экземпляр AnimateFieldDisplay или None, если анимация не нужна.
+        Поле передается в display прореженным с шагом display.step.
+    display_period - шаг по времени между обновлениями графика.
+
+    Возвращает массивы сигналов полей E и H в датчиках (строка - датчик).
+    '''
+    maxSize = eps.shape[0]
+
+    # Коэффициенты для расчета поля Е
+    ceze = (1 - loss) / (1 + loss)
+    cezh = W0 / (eps * (1 + loss))
+
+    # Коэффициенты для расчеты поля Н
+    chyh = (1 - loss) / (1 + loss)
+    chye = 1 / (W0 * (1 + loss))
+
+    # Усреднение коэффициентов на границе поглощающего слоя
+    for pos in lossBoundaries:
+        ceze[pos] = (ceze[pos - 1] + ceze[pos + 1]) / 2
+        cezh[pos] = (cezh[pos - 1] + cezh[pos + 1]) / 2
+
+    # Поля и коэффициенты хранятся в одинарной точности: расчет
+    # ограничен пропускной способностью памяти, а ошибка округления
+    # много меньше ошибки дискретизации.
+    # Ядро step скомпилировано для непрерывных массивов
+    # float32, что позволяет компилятору векторизовать циклы
+    ceze = numpy.ascontiguousarray(ceze, dtype=numpy.float32)
+    cezh = numpy.ascontiguousarray(cezh, dtype=numpy.float32)
+    chyh = numpy.ascontiguousarray(chyh, dtype=numpy.float32)
+    chye = numpy.ascontiguousarray(chye, dtype=numpy.float32)
+
+    Ez = numpy.zeros(maxSize, dtype=numpy.float32)
+    Hy = numpy.zeros(maxSize - 1, dtype=numpy.float32)
+
+    # Множители при отсчетах источника в методе TFSF
+    src_H_coef = Sc / (W0 * mu[sourcePos - 1])
+    src_E_coef = Sc / numpy.sqrt(eps[sourcePos] * mu[sourcePos])
+
+    # Отсчеты источника для поля H (в точке 0, момент q)
+    # и для поля E (в точке -0.5, момент q + 0.5) на всех временных шагах
+    timeSteps = numpy.arange(maxTime)
+    src_H = (src_H_coef * source.getField(0, timeSteps)).astype(numpy.float32)
+    src_E = (src_E_coef *
+             source.getField(-0.5, timeSteps + 0.5)).astype(numpy.float32)
+
+    # Сигналы всех датчиков хранятся в общих непрерывных массивах
+    # (строка - датчик), которые заполняются на каждом шаге одной операцией
+    # индексации. Все отсчеты перезаписываются, поэтому обнулять массивы
+    # не нужно
+    probe_idx = numpy.asarray(probesPos)
+    E_hist = numpy.empty((len(probesPos), maxTime), dtype=numpy.float32)
+    H_hist = numpy.empty((len(probesPos), maxTime), dtype=numpy.float32)
+
+    # Функция расчета одного временного шага. Без numba используется
+    # stepNumpy с буферами, выделенными один раз на весь расчет
+    if step is not None:
+        stepFn = step
+    else:
+        stepFn = partial(stepNumpy,
+                         dE=numpy.empty(maxSize - 1, dtype=numpy.float32),
+                         dH=numpy.empty(maxSize - 2, dtype=numpy.float32))
+
+    for q in range(maxTime):
+        # Расчет полей E и H с источником и граничными условиями
+        stepFn(Ez, Hy, ceze, cezh, chyh, chye, src_H, src_E, sourcePos, q)
+
+        # Регистрация поля в датчиках
+        E_hist[:, q] = Ez.take(probe_idx)
+        H_hist[:, q] = Hy.take(probe_idx)
+
+        if display is not None and q % display_period == 0:
+            display.updateData(Ez[::display.step], q)
+
+    return E_hist, H_hist
+
+
+if __name__ == '__main__':
     # Число Куранта
     Sc = 1.0
 
@@ -59,7 +232,6 @@ if __name__ == '__main__':
 
     # Датчики для регистрации поля
     probesPos = [75,125]
-    probes = [tools.Probe(pos, maxTime) for pos in probesPos]
 
     #1й слой диэлектрика
     eps1 = 3.5
@@ -76,13 +248,13 @@ if __name__ == '__main__':
 
     # Параметры среды
     # Диэлектрическая проницаемость
-    eps = numpy.ones(maxSize)
+    eps = numpy.ones(maxSize, dtype=numpy.float32)
     eps[int(maxSize/2):layer_1] = eps1
     eps[layer_1:layer_2] = eps2
     eps[layer_2:] = eps3
     
     # Магнитная проницаемость
-    mu = numpy.ones(maxSize - 1)
+    mu = numpy.ones(maxSize - 1, dtype=numpy.float32)
 
     # Где начинается поглощающий диэлектрик слева
     layer_loss_x_left = 50
@@ -91,32 +263,10 @@ if __name__ == '__main__':
     layer_loss_x_right = 950
 
     # Потери в среде. Loss = sigma * dt / (2 * eps * eps0)
-    loss = numpy.zeros(maxSize)
+    loss = numpy.zeros(maxSize, dtype=numpy.float32)
     loss[layer_loss_x_right:] = 0.02
     loss[:layer_loss_x_left] = 0.02
 
-    # Коэффициенты для расчета поля Е
-    ceze = (1 - loss) / (1 + loss)
-    cezh = W0 / (eps * (1 + loss))
-
-    # Коэффициенты для расчеты поля Н
-    chyh = (1 - loss) / (1 + loss)
-    chye = 1 / (W0 * (1 + loss))
-
-    # Усреднение коэффициентов на границе поглощающего слоя
-    ceze[layer_loss_x_left] = (ceze[layer_loss_x_left - 1]
-                               + ceze[layer_loss_x_left + 1]) / 2
-    cezh[layer_loss_x_left] = (cezh[layer_loss_x_left - 1]
-                          + cezh[layer_loss_x_left + 1]) / 2
-
-    ceze[layer_loss_x_right] = (ceze[layer_loss_x_right - 1]
-                               + ceze[layer_loss_x_right + 1]) / 2
-    cezh[layer_loss_x_right] = (cezh[layer_loss_x_right - 1]
-                          + cezh[layer_loss_x_right + 1]) / 2
-
-    Ez = numpy.zeros(maxSize)
-    Hy = numpy.zeros(maxSize - 1)
-
     # Максимальная и манимальная частоты для отображения
     # графика зависимости коэффициента отражения от частоты
     Fmin = 5e9
@@ -137,55 +287,50 @@ if __name__ == '__main__':
     N1 = Sc * N1 / dt
 
     source = GaussianModPlaneWave(dg, wg, N1, eps[sourcePos], mu[sourcePos])
-    
+
     # Параметры отображения поля E
-    display_field = Ez
     display_ylabel = 'Ez, В/м'
     display_ymin = -1.1
     display_ymax = 1.1
 
-    # Создание экземпляра класса для отображения
-    # распределения поля в пространстве
-    display = tools.AnimateFieldDisplay(maxSize,
-                                        display_ymin, display_ymax,
-                                        display_ylabel,dx)
-
-    display.activate()
-    display.drawProbes(probesPos)
-    display.drawSources([sourcePos])
-    display.drawBoundary(int(maxSize / 2))
-    display.drawBoundary(layer_1)
-    display.drawBoundary(layer_2)
-
-    for q in range(maxTime):
-        # Расчет компоненты поля Н
-        Hy = chyh[:-1] * Hy + chye[:-1] * (Ez[1:] - Ez[:-1])
-
-        # Источник возбуждения с использованием метода
-        # Total Field / Scattered Field
-        Hy[sourcePos - 1] -= Sc / (W0 * mu[sourcePos - 1]) * source.getField(0, q)
-
-        # Граничные условия для поля E
-        Ez[0] = Ez[1]
-        Ez[-1] = Ez[-2]
-
-        # Расчет компоненты поля E
-        Hy_shift = Hy[:-1]
-        Ez[1:-1] = ceze[1:-1] * Ez[1:-1] + cezh[1:-1] * (Hy[1:] - Hy_shift)
-
-        # Источник возбуждения с использованием метода
-        # Total Field / Scattered Field
-        Ez[sourcePos] += (Sc / (numpy.sqrt(eps[sourcePos] * mu[sourcePos])) *
-                          source.getField(-0.5, q + 0.5))
-
-        # Регистрация поля в датчиках
-        for probe in probes:
-            probe.addData(Ez, Hy)
-
-        if q % 5 == 0:
-            display.updateData(display_field, q)
-
-    display.stop()
+    # Шаг по времени между обновлениями графика
+    # и шаг прореживания отображаемого поля в пространстве
+    display_period = 25
+    display_step = 2
+
+    # Анимацию можно отключить переменной окружения FDTD_NO_DISPLAY=1,
+    # например, для измерения времени расчета
+    display_enabled = os.environ.get('FDTD_NO_DISPLAY', '0') != '1'
+
+    if display_enabled:
+        # Создание экземпляра класса для отображения
+        # распределения поля в пространстве
+        display = tools.AnimateFieldDisplay(maxSize,
+                                            display_ymin, display_ymax,
+                                            display_ylabel, dx, display_step)
+
+        display.activate()
+        display.drawProbes(probesPos)
+        display.drawSources([sourcePos])
+        display.drawBoundary(int(maxSize / 2))
+        display.drawBoundary(layer_1)
+        display.drawBoundary(layer_2)
+    else:
+        display = None
+
+    E_hist, H_hist = runFDTD(eps, mu, loss,
+                             [layer_loss_x_left, layer_loss_x_right],
+                             source, sourcePos, probesPos, maxTime, Sc,
+                             display, display_period)
+
+    if display_enabled:
+        display.stop()
+
+    # Датчики с зарегистрированными сигналами. showProbeSignals обнуляет
+    # часть сигнала E во втором датчике, поэтому сигналы E копируются,
+    # чтобы не изменять E_hist, по которому рассчитываются спектры
+    probes = [tools.Probe(pos, maxTime, probeE.copy(), probeH)
+              for pos, probeE, probeH in zip(probesPos, E_hist, H_hist)]
     
 
     # Отображение сигнала, сохраненного в датчиках
@@ -196,38 +341,46 @@ if __name__ == '__main__':
     Fmin = 5e9
     Fmax = 30e9
     
-    # Размер массива для ПФ
-    size = 2 ** 16
+    # Размер массива для ПФ. Длина подбирается функцией next_fast_len,
+    # чтобы при изменении maxTime или size не попасть на длину с большими
+    # простыми множителями, для которых БПФ резко замедляется
+    size = fft.next_fast_len(max(2 ** 16, 2 * E_hist.shape[1]), real=True)
+
+    # Сигналы вещественные, поэтому достаточно БПФ для вещественных
+    # данных (rfft), которое дает только неотрицательные частоты.
+    # БПФ падающего и отраженного поля выполняются одним вызовом
+    # для двух строк массива
+    Fields = numpy.zeros((2, maxTime))
+
+    # Выдедение падающего поля
+    Fields[0, :300] = E_hist[1, :300]
 
-    # Выдедение падающего поля 
-    FallField = numpy.zeros(maxTime)
-    FallField[:300] = probes[1].E[:300]
+    # Отраженное поле
+    Fields[1] = E_hist[0]
 
-    # Нахождение БПФ падающего поля
-    FallSpectr = abs(fft.fft(FallField, size))
-    FallSpectr = fft.fftshift(FallSpectr)
+    Spectra = numpy.abs(fft.rfft(Fields, n=size, axis=1, workers=-1))
+    FallSpectr, ScatteredSpectr = Spectra
 
-    # Нахождение БПФ отраженного поля
-    ScatteredSpectr = abs(fft.fft(probes[0].E, size))
-    ScatteredSpectr = fft.fftshift(ScatteredSpectr)
+    # Определение частотной оси
+    f = fft.rfftfreq(size, dt)
 
-    # шаг по частоте и определение частотной оси
-    df = 1 / (size * dt)
-    f = numpy.arange(-(size / 2) * df, (size / 2) * df, df)
+    # Частотная ось в ГГц и нормировочный множитель для графиков
+    f_GHz = f * 1e-9
+    FallSpectrMax = numpy.max(FallSpectr)
 
     # Построение спектра падающего и рассеянного поля
     plt.figure()
-    plt.plot(f * 1e-9, FallSpectr / numpy.max(FallSpectr))
-    plt.plot(f * 1e-9, ScatteredSpectr / numpy.max(FallSpectr))
+    plt.plot(f_GHz, FallSpectr / FallSpectrMax)
+    plt.plot(f_GHz, ScatteredSpectr / FallSpectrMax)
     plt.grid()
-    plt.xlim(0, 35e9 * 1e-9)
+    plt.xlim(0, 35)
     plt.xlabel('f, ГГц')
     plt.ylabel('|S/Smax|')
     plt.legend(['Спектр падающего поля', 'Спектр отраженного поля'], loc=1)
 
     # Определение коэффициента отражения и построения графика
     plt.figure()
-    plt.plot(f * 1e-9, (ScatteredSpectr / FallSpectr))
+    plt.plot(f_GHz, ScatteredSpectr / FallSpectr)
     plt.xlim(Fmin * 1e-9, Fmax * 1e-9)
     plt.ylim(0, 1)
     plt.grid()
@@ -14,19 +14,23 @@ class Probe:
     '''
     Класс для хранения временного сигнала в датчике.
     '''
-    def __init__(self, position: int, maxTime: int):
+    def __init__(self, position: int, maxTime: int,
+                 E: numpy.ndarray = None, H: numpy.ndarray = None):
         '''
         position - положение датчика (номер ячейки).
         maxTime - максимально количество временных шагов для хранения в датчике.
+        E, H - уже зарегистрированные сигналы полей E и H длиной maxTime.
+            Если заданы, датчик хранит эти массивы (без копирования) вместо
+            создания новых.
         '''
         self.position = position
 
         # Временные сигналы для полей E и H
-        self.E = numpy.zeros(maxTime)
-        self.H = numpy.zeros(maxTime)
+        self.E = numpy.zeros(maxTime) if E is None else E
+        self.H = numpy.zeros(maxTime) if H is None else H
 
         # Номер временного шага для сохранения полей
-        self._time = 0
+        self._time = 0 if E is None else maxTime
 
     def addData(self, E: List[float], H: List[float]):
         '''
@@ -45,14 +49,17 @@ class AnimateFieldDisplay:
     def __init__(self,
                  maxXSize: int,
                  minYSize: float, maxYSize: float,
-                 yLabel: str, dx: float):
+                 yLabel: str, dx: float, step: int = 1):
         '''
         maxXSize - размер области моделирования в отсчетах.
         minYSize, maxYSize - интервал отображения графика по оси Y.
         yLabel - метка для оси Y.
         dx - размер ячейки разбиения.
+        step - шаг прореживания отображаемого поля (в отсчетах). В updateData
+            должно передаваться поле, прореженное с тем же шагом.
         '''
         self.dx = dx
+        self.step = step
         self.maxXSize = maxXSize
         self.minYSize = minYSize
         self.maxYSize = maxYSize
@@ -67,7 +74,7 @@ class AnimateFieldDisplay:
         '''
         Инициализировать окно с анимацией
         '''
-        self._xList = numpy.arange(self.maxXSize) * self.dx
+        self._xList = numpy.arange(0, self.maxXSize, self.step) * self.dx
 
         # Включить интерактивный режим для анимации
         pylab.ion()
@@ -87,7 +94,7 @@ class AnimateFieldDisplay:
         self._ax.grid()
 
         # Отобразить поле в начальный момент времени
-        self._line, = self._ax.plot(self._xList, numpy.zeros(self.maxXSize))
+        self._line, = self._ax.plot(self._xList, numpy.zeros(len(self._xList)))
 
     def drawProbes(self, probesPos: List[int]):
         '''